@@ -4,37 +4,65 @@
 # Derived from: https://minimalmodbus.readthedocs.io/en/stable/
 # Written by Nicholas Robinson
 
+import array
 import os
 import struct
 import sys
 import time
 import binascii
-long = int
+_PY3 = sys.version_info[0] >= 3
+
+# Types accepted by the checkers, long only exists on Python 2
+try:
+    _INT_TYPES = (int, long)
+except NameError:
+    _INT_TYPES = (int,)
+_NUM_TYPES = _INT_TYPES + (float,)
+_INT_OR_NONE_TYPES = _INT_TYPES + (type(None),)
+_NUM_OR_NONE_TYPES = _NUM_TYPES + (type(None),)
 
 import busio
 import board
 from digitalio import DigitalInOut, Pull, Direction
-
-_NUMBER_OF_BYTES_BEFORE_REGISTERDATA = 1
-_NUMBER_OF_BYTES_PER_REGISTER = 2
-_MAX_NUMBER_OF_REGISTERS_TO_WRITE = 123
-_MAX_NUMBER_OF_REGISTERS_TO_READ = 125
-_MAX_NUMBER_OF_BITS_TO_WRITE = 1968
-_MAX_NUMBER_OF_BITS_TO_READ = 2000
-_MAX_NUMBER_OF_DECIMALS = 10
-_MAX_BYTEORDER_VALUE = 3
-_SECONDS_TO_MILLISECONDS = 1000
-_BITS_PER_BYTE = 8
-_BYTEPOSITION_FOR_SLAVEADDRESS = 0
-_BYTEPOSITION_FOR_FUNCTIONCODE = 1
-_BYTEPOSITION_FOR_SLAVE_ERROR_CODE = 2
-_BITNUMBER_FUNCTIONCODE_ERRORINDICATION = 7
+from micropython import const
+
+# Optional, for hosts running CPython (with Blinka)
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+try:
+    from numba import njit
+except ImportError:
+    njit = None
+
+_NUMBER_OF_BYTES_BEFORE_REGISTERDATA = const(1)
+_NUMBER_OF_BYTES_BEFORE_WRITEDATA = const(5)
+_NUMBER_OF_BYTES_PER_REGISTER = const(2)
+_MAX_NUMBER_OF_REGISTERS_TO_WRITE = const(123)
+_MAX_NUMBER_OF_REGISTERS_TO_READ = const(125)
+_MAX_NUMBER_OF_BITS_TO_WRITE = const(1968)
+_MAX_NUMBER_OF_BITS_TO_READ = const(2000)
+_MAX_NUMBER_OF_DECIMALS = const(10)
+_MAX_NUMBER_OF_CACHED_REQUESTS = const(16)
+_MAX_RESPONSE_LENGTH = const(256)
+_MAX_BYTEORDER_VALUE = const(3)
+_SECONDS_TO_MILLISECONDS = const(1000)
+_BYTEPOSITION_FOR_SLAVEADDRESS = const(0)
+_BYTEPOSITION_FOR_FUNCTIONCODE = const(1)
+_BYTEPOSITION_FOR_SLAVE_ERROR_CODE = const(2)
+_BITNUMBER_FUNCTIONCODE_ERRORINDICATION = const(7)
 
 MODE_RTU = "rtu"
-BYTEORDER_BIG = 0
-BYTEORDER_LITTLE = 1
-BYTEORDER_BIG_SWAP = 2
-BYTEORDER_LITTLE_SWAP = 3
+BYTEORDER_BIG = const(0)
+BYTEORDER_LITTLE = const(1)
+BYTEORDER_BIG_SWAP = const(2)
+BYTEORDER_LITTLE_SWAP = const(3)
+
+# Masks for the bits of a Modbus register, indexed by bit number, so only
+# bit numbers 0 to 15 can be looked up
+_BIT_MASKS = tuple(1 << i for i in range(16))
 
 _PAYLOADFORMAT_BIT = "bit"
 _PAYLOADFORMAT_BITS = "bits"
@@ -53,6 +81,10 @@ _ALL_PAYLOADFORMATS = [
 
 class Instrument:
     """Class for talking to slave devices with RTU and RS-485"""
+
+    # Seconds to wait for the slave to start answering
+    timeout = 2.0
+
     def __init__(
         self,
         slaveaddress=1,
@@ -61,9 +93,16 @@ class Instrument:
         stop=1):
         """Initialize instrument and open corresponding serial port"""
 
+        _check_slaveaddress(slaveaddress)
+
         self.address = slaveaddress
         self.mode = MODE_RTU
-        self.prev_time = 0.0
+        self.request_cache = {}
+        self.receive_buffer = bytearray(_MAX_RESPONSE_LENGTH)
+        self.receive_view = memoryview(self.receive_buffer)
+        self.next_request_time = 0.0
+        self.minimum_silent_period = _calculate_minimum_silent_period(baudrate)
+        self.character_time = _calculate_character_time(baudrate)
 
         if "IO7" in dir(board):
             self.rs485_ctrl = DigitalInOut(board.IO7) # ESP32s2
@@ -79,7 +118,7 @@ class Instrument:
                                  bits=8,
                                  parity=parity,
                                  stop=stop,
-                                 timeout=2.0)
+                                 timeout=self.timeout)
 
     def read_bits(self, registeraddress, number_of_bits=1):
         """Read multiple bits from the slave (instrument)"""
@@ -239,6 +278,93 @@ class Instrument:
         payloadformat=None):
         """Perform generic command for reading and writing registers and bits"""
 
+        # Validate before the cache lookup, as arguments of the wrong type can
+        # compare equal to valid ones, for example 1.0 and 1
+        self._check_command(
+            functioncode,
+            registeraddress,
+            number_of_decimals,
+            number_of_registers,
+            number_of_bits,
+            signed,
+            byteorder)
+
+        # Requests without a value to write (reads) are the same every time,
+        # so they are built once and then reused
+        if value is None:
+            cache_key = (
+                self.address,
+                functioncode,
+                registeraddress,
+                number_of_decimals,
+                number_of_registers,
+                number_of_bits,
+                signed,
+                byteorder,
+                payloadformat)
+
+            prepared_request = self.request_cache.get(cache_key)
+            if prepared_request is None:
+                prepared_request = self._prepare_request(
+                    functioncode,
+                    registeraddress,
+                    value,
+                    number_of_decimals,
+                    number_of_registers,
+                    number_of_bits,
+                    signed,
+                    byteorder,
+                    payloadformat)
+
+                if len(self.request_cache) >= _MAX_NUMBER_OF_CACHED_REQUESTS:
+                    self.request_cache.clear()
+                self.request_cache[cache_key] = prepared_request
+        else:
+            prepared_request = self._prepare_request(
+                functioncode,
+                registeraddress,
+                value,
+                number_of_decimals,
+                number_of_registers,
+                number_of_bits,
+                signed,
+                byteorder,
+                payloadformat)
+
+        request, number_of_bytes_to_read = prepared_request
+
+     	# Communicate with instrument
+        payload_from_slave = self._perform_command(
+            functioncode, request, number_of_bytes_to_read)
+
+        # Parse response payload
+        return _parse_payload(
+            payload_from_slave,
+            functioncode,
+            registeraddress,
+            value,
+            number_of_decimals,
+            number_of_registers,
+            number_of_bits,
+            signed,
+            byteorder,
+            payloadformat)
+
+    def _check_command(
+        self,
+        functioncode,
+        registeraddress,
+        number_of_decimals,
+        number_of_registers,
+        number_of_bits,
+        signed,
+        byteorder):
+        """Check the arguments of a command, and the slave settings it uses"""
+
+        # The address and mode are public attributes, and may have been changed
+        _check_slaveaddress(self.address)
+        _check_mode(self.mode)
+        _check_functioncode(functioncode, None)
         _check_registeraddress(registeraddress)
         _check_int(
             number_of_decimals,
@@ -266,6 +392,19 @@ class Instrument:
             maxvalue=_MAX_BYTEORDER_VALUE,
             description="byteorder")
 
+    def _prepare_request(
+        self,
+        functioncode,
+        registeraddress,
+        value,
+        number_of_decimals,
+        number_of_registers,
+        number_of_bits,
+        signed,
+        byteorder,
+        payloadformat):
+        """Build the request and predict the size of the response"""
+
         # Create payload
         payload_to_slave = _create_payload(
             functioncode,
@@ -278,33 +417,17 @@ class Instrument:
             byteorder,
             payloadformat)
 
-     	# Communicate with instrument
-        payload_from_slave = self._perform_command(functioncode, payload_to_slave)
-
-        # Parse response payload
-        return _parse_payload(
-            payload_from_slave,
-            functioncode,
-            registeraddress,
-            value,
-            number_of_decimals,
-            number_of_registers,
-            number_of_bits,
-            signed,
-            byteorder,
-            payloadformat)
-
-    def _perform_command(self, functioncode, payload_to_slave):
-        """Perform the command having the *functioncode* """
-
-        _check_functioncode(functioncode, None)
-
         request = _embed_payload(
             self.address, self.mode, functioncode, payload_to_slave)
 
         number_of_bytes_to_read = _predict_response_size(
                 self.mode, functioncode, payload_to_slave)
 
+        return request, number_of_bytes_to_read
+
+    def _perform_command(self, functioncode, request, number_of_bytes_to_read):
+        """Perform the command having the *functioncode* """
+
         response = self._communicate(request, number_of_bytes_to_read)
 
         payload_from_slave = _extract_payload(
@@ -315,30 +438,38 @@ class Instrument:
     def _communicate(self, request, number_of_bytes_to_read):
         """Talk to the slave via a serial port"""
 
-        _check_int(number_of_bytes_to_read)
-
-        minimum_silent_period = _calculate_minimum_silent_period(self.serial.baudrate)
-        time_since_read = time.monotonic() - self.prev_time
-
-        if time_since_read < minimum_silent_period:
-            sleep_time = minimum_silent_period - time_since_read
+        sleep_time = self.next_request_time - time.monotonic()
+        if sleep_time > 0:
             time.sleep(sleep_time)
 
-        self.prev_time = time.monotonic()
         #print("Request: {}".format(_hexlify(request)))
 
         self.rs485_ctrl.value = True
         self.serial.reset_input_buffer()
         self.serial.write(request)
         self.rs485_ctrl.value = False
-        self.prev_time = time.monotonic()
 
-        answer = self.serial.read(number_of_bytes_to_read)
-        #print("Answer: {}".format(_hexlify(answer)))
+        # Wait for the slave to start answering, then only for as long as the
+        # rest of the frame takes, so that short (error) responses return early
+        # The answer is read straight into the receive buffer, and is only
+        # valid until the next command
+        receive_view = self.receive_view
 
-        if not answer:
+        self.serial.timeout = self.timeout
+        if not self.serial.readinto(receive_view[:1]):
             raise ValueError("No communication with the instrument (no answer)")
 
+        self.serial.timeout = _calculate_response_timeout(
+            self.minimum_silent_period, self.character_time, number_of_bytes_to_read - 1)
+        number_of_bytes_read = 1 + (
+            self.serial.readinto(receive_view[1:number_of_bytes_to_read]) or 0)
+
+        # The bus has to be silent for a while after the end of the response
+        self.next_request_time = time.monotonic() + self.minimum_silent_period
+
+        answer = receive_view[:number_of_bytes_read]
+        #print("Answer: {}".format(_hexlify(answer)))
+
         return answer
 
 def _create_payload(
@@ -353,47 +484,144 @@ def _create_payload(
     payloadformat):
     """Create the payload"""
 
-    if functioncode in [1, 2]:
-        return _num_to_twobyte_string(registeraddress) + _num_to_twobyte_string(
-            number_of_bits)
+    try:
+        create = _PAYLOAD_CREATORS[functioncode]
+    except KeyError:
+        raise ValueError("Wrong function code: " + str(functioncode))
 
-    if functioncode in [3, 4]:
-        return _num_to_twobyte_string(registeraddress) + _num_to_twobyte_string(
-            number_of_registers)
+    return create(
+        registeraddress,
+        value,
+        number_of_decimals,
+        number_of_registers,
+        number_of_bits,
+        signed,
+        byteorder,
+        payloadformat)
 
-    if functioncode == 15:
-        if payloadformat == _PAYLOADFORMAT_BIT:
-            bitlist = [value]
-        else:
-            bitlist = value
-        return (
-            _num_to_twobyte_string(registeraddress)
-            + _num_to_twobyte_string(number_of_bits)
-            + _num_to_onebyte_string(
-                _calculate_number_of_bytes_for_bits(number_of_bits))
-            + _bits_to_bytestring(bitlist))
-
-    if functioncode == 16:
-        if payloadformat == _PAYLOADFORMAT_REGISTER:
-            registerdata = _num_to_twobyte_string(
-                value, number_of_decimals, signed=signed)
-
-        elif payloadformat == _PAYLOADFORMAT_LONG:
-            registerdata = _long_to_bytestring(
-                value, signed, number_of_registers, byteorder)
-
-        elif payloadformat == _PAYLOADFORMAT_FLOAT:
-            registerdata = _float_to_bytestring(value, number_of_registers, byteorder)
-        elif payloadformat == _PAYLOADFORMAT_REGISTERS:
-            registerdata = _valuelist_to_bytestring(value, number_of_registers)
-
-        return (
-            _num_to_twobyte_string(registeraddress)
-            + _num_to_twobyte_string(number_of_registers)
-            + _num_to_onebyte_string(len(registerdata))
-            + registerdata)
-
-    raise ValueError("Wrong function code: " + str(functioncode))
+def _create_read_bits_payload(
+    registeraddress,
+    value,
+    number_of_decimals,
+    number_of_registers,
+    number_of_bits,
+    signed,
+    byteorder,
+    payloadformat):
+    """Create the payload for reading bits (function code 1 and 2)"""
+
+    return struct.pack(">HH", registeraddress, number_of_bits)
+
+def _create_read_registers_payload(
+    registeraddress,
+    value,
+    number_of_decimals,
+    number_of_registers,
+    number_of_bits,
+    signed,
+    byteorder,
+    payloadformat):
+    """Create the payload for reading registers (function code 3 and 4)"""
+
+    return struct.pack(">HH", registeraddress, number_of_registers)
+
+def _create_write_bits_payload(
+    registeraddress,
+    value,
+    number_of_decimals,
+    number_of_registers,
+    number_of_bits,
+    signed,
+    byteorder,
+    payloadformat):
+    """Create the payload for writing bits (function code 15)"""
+
+    if payloadformat == _PAYLOADFORMAT_BIT:
+        bitlist = [value]
+    else:
+        bitlist = value
+    registerdata = _bits_to_bytestring(bitlist)
+    number_of_bytes = _calculate_number_of_bytes_for_bits(number_of_bits)
+
+    payload = bytearray(_NUMBER_OF_BYTES_BEFORE_WRITEDATA + len(registerdata))
+    struct.pack_into(
+        ">HHB", payload, 0, registeraddress, number_of_bits, number_of_bytes)
+    payload[_NUMBER_OF_BYTES_BEFORE_WRITEDATA:] = registerdata
+    return payload
+
+def _create_write_registers_payload(
+    registeraddress,
+    value,
+    number_of_decimals,
+    number_of_registers,
+    number_of_bits,
+    signed,
+    byteorder,
+    payloadformat):
+    """Create the payload for writing registers (function code 16)"""
+
+    try:
+        pack_into = _REGISTERDATA_PACKERS[payloadformat]
+    except KeyError:
+        raise ValueError(
+            "Wrong payloadformat for writing registers: " + str(payloadformat))
+
+    number_of_bytes = _NUMBER_OF_BYTES_PER_REGISTER * number_of_registers
+
+    payload = bytearray(_NUMBER_OF_BYTES_BEFORE_WRITEDATA + number_of_bytes)
+    struct.pack_into(
+        ">HHB", payload, 0, registeraddress, number_of_registers, number_of_bytes)
+
+    pack_into(
+        payload,
+        _NUMBER_OF_BYTES_BEFORE_WRITEDATA,
+        value,
+        number_of_decimals,
+        number_of_registers,
+        signed,
+        byteorder)
+    return payload
+
+_PAYLOAD_CREATORS = {
+    1: _create_read_bits_payload,
+    2: _create_read_bits_payload,
+    3: _create_read_registers_payload,
+    4: _create_read_registers_payload,
+    15: _create_write_bits_payload,
+    16: _create_write_registers_payload}
+
+# The register data packers and the parsers below share an argument list,
+# so that they can be looked up by payloadformat and called the same way
+
+def _pack_register(
+    buffer, offset, value, number_of_decimals, number_of_registers, signed, byteorder):
+    """Pack a single register value, possibly scaled"""
+
+    _num_into_twobyte_string(buffer, offset, value, number_of_decimals, signed=signed)
+
+def _pack_registers(
+    buffer, offset, value, number_of_decimals, number_of_registers, signed, byteorder):
+    """Pack a list of register values"""
+
+    _valuelist_into_bytestring(buffer, offset, value, number_of_registers)
+
+def _pack_float(
+    buffer, offset, value, number_of_decimals, number_of_registers, signed, byteorder):
+    """Pack a float value"""
+
+    _float_into_bytestring(buffer, offset, value, number_of_registers, byteorder)
+
+def _pack_long(
+    buffer, offset, value, number_of_decimals, number_of_registers, signed, byteorder):
+    """Pack a long integer value"""
+
+    _long_into_bytestring(buffer, offset, value, signed, number_of_registers, byteorder)
+
+_REGISTERDATA_PACKERS = {
+    _PAYLOADFORMAT_REGISTER: _pack_register,
+    _PAYLOADFORMAT_REGISTERS: _pack_registers,
+    _PAYLOADFORMAT_FLOAT: _pack_float,
+    _PAYLOADFORMAT_LONG: _pack_long}
 
 def _parse_payload(
     payload,
@@ -419,42 +647,97 @@ def _parse_payload(
         byteorder,
         payloadformat)
 
-    if functioncode in [1, 2]:
-        registerdata = payload[_NUMBER_OF_BYTES_BEFORE_REGISTERDATA:]
-        if payloadformat == _PAYLOADFORMAT_BIT:
-            return _bytestring_to_bits(registerdata, number_of_bits)[0]
-        elif payloadformat == _PAYLOADFORMAT_BITS:
-            return _bytestring_to_bits(registerdata, number_of_bits)
+    # Write confirmations carry no data to return
+    parsers = _PAYLOAD_PARSERS.get(functioncode)
+    if parsers is None:
+        return None
+
+    parse = parsers.get(payloadformat)
+    if parse is None:
+        return None
+
+    registerdata = payload[_NUMBER_OF_BYTES_BEFORE_REGISTERDATA:]
+    return parse(
+        registerdata,
+        number_of_decimals,
+        number_of_registers,
+        number_of_bits,
+        signed,
+        byteorder)
+
+def _parse_bit(
+    registerdata, number_of_decimals, number_of_registers, number_of_bits,
+    signed, byteorder):
+    """Parse a single bit"""
+
+    return _bytestring_to_bits(registerdata, number_of_bits)[0]
 
-    if functioncode in [3, 4]:
-        registerdata = payload[_NUMBER_OF_BYTES_BEFORE_REGISTERDATA:]
+def _parse_bits(
+    registerdata, number_of_decimals, number_of_registers, number_of_bits,
+    signed, byteorder):
+    """Parse a list of bits"""
 
-        if payloadformat == _PAYLOADFORMAT_LONG:
-            return _bytestring_to_long(
-                registerdata, signed, number_of_registers, byteorder)
+    return _bytestring_to_bits(registerdata, number_of_bits)
 
-        elif payloadformat == _PAYLOADFORMAT_FLOAT:
-            return _bytestring_to_float(registerdata, number_of_registers, byteorder)
+def _parse_register(
+    registerdata, number_of_decimals, number_of_registers, number_of_bits,
+    signed, byteorder):
+    """Parse a single register value, possibly scaled"""
 
-        elif payloadformat == _PAYLOADFORMAT_REGISTERS:
-            return _bytestring_to_valuelist(registerdata, number_of_registers)
+    return _twobyte_string_to_num(registerdata, number_of_decimals, signed=signed)
 
-        elif payloadformat == _PAYLOADFORMAT_REGISTER:
-            return _twobyte_string_to_num(
-                registerdata, number_of_decimals, signed=signed)
+def _parse_registers(
+    registerdata, number_of_decimals, number_of_registers, number_of_bits,
+    signed, byteorder):
+    """Parse a list of register values"""
+
+    return _bytestring_to_valuelist(registerdata, number_of_registers)
+
+def _parse_float(
+    registerdata, number_of_decimals, number_of_registers, number_of_bits,
+    signed, byteorder):
+    """Parse a float value"""
+
+    return _bytestring_to_float(registerdata, number_of_registers, byteorder)
+
+def _parse_long(
+    registerdata, number_of_decimals, number_of_registers, number_of_bits,
+    signed, byteorder):
+    """Parse a long integer value"""
+
+    return _bytestring_to_long(registerdata, signed, number_of_registers, byteorder)
+
+_BITDATA_PARSERS = {
+    _PAYLOADFORMAT_BIT: _parse_bit,
+    _PAYLOADFORMAT_BITS: _parse_bits}
+
+_REGISTERDATA_PARSERS = {
+    _PAYLOADFORMAT_REGISTER: _parse_register,
+    _PAYLOADFORMAT_REGISTERS: _parse_registers,
+    _PAYLOADFORMAT_FLOAT: _parse_float,
+    _PAYLOADFORMAT_LONG: _parse_long}
+
+_PAYLOAD_PARSERS = {
+    1: _BITDATA_PARSERS,
+    2: _BITDATA_PARSERS,
+    3: _REGISTERDATA_PARSERS,
+    4: _REGISTERDATA_PARSERS}
 
 def _embed_payload(slaveaddress, mode, functioncode, payloaddata):
     """Build a request from the slaveaddress, the function code and the payload data"""
 
-    _check_slaveaddress(slaveaddress)
-    _check_mode(mode)
+    NUMBER_OF_REQUEST_STARTBYTES = 2
+    NUMBER_OF_CRC_BYTES = 2
 
-    first_part = b""
-    first_part += _num_to_onebyte_string(slaveaddress)
-    first_part += _num_to_onebyte_string(functioncode)
-    first_part += payloaddata
+    crc_position = NUMBER_OF_REQUEST_STARTBYTES + len(payloaddata)
+    request = bytearray(crc_position + NUMBER_OF_CRC_BYTES)
 
-    return first_part + _calculate_crc_string(first_part)
+    struct.pack_into(">BB", request, 0, slaveaddress, functioncode)
+    request[NUMBER_OF_REQUEST_STARTBYTES:crc_position] = payloaddata
+    struct.pack_into(
+        "<H", request, crc_position, _crc16(memoryview(request)[:crc_position]))
+
+    return request
 
 def _extract_payload(response, slaveaddress, mode, functioncode):
     """Extract the payload data part from the slave's response"""
@@ -463,22 +746,20 @@ def _extract_payload(response, slaveaddress, mode, functioncode):
     NUMBER_OF_CRC_BYTES = 2
     MINIMAL_RESPONSE_LENGTH_RTU = NUMBER_OF_RESPONSE_STARTBYTES + NUMBER_OF_CRC_BYTES
 
-    _check_slaveaddress(slaveaddress)
-    _check_mode(mode)
-    _check_functioncode(functioncode, None)
-
     plainresponse = response
 
     if len(response) < MINIMAL_RESPONSE_LENGTH_RTU:
         raise ValueError(
             "Too short Modbus RTU response (minimum length {} bytes). Response: {!r}".format(
-                MINIMAL_RESPONSE_LENGTH_RTU, response))
+                MINIMAL_RESPONSE_LENGTH_RTU, bytes(response)))
 
     calculate_checksum = _calculate_crc_string
     number_of_checksum_bytes = NUMBER_OF_CRC_BYTES
 
-    received_checksum = response[-number_of_checksum_bytes:]
-    response_without_checksum = response[0 : (len(response) - number_of_checksum_bytes)]
+    # Slices of the memoryview share the response buffer instead of copying
+    response_view = memoryview(response)
+    received_checksum = bytes(response_view[-number_of_checksum_bytes:])
+    response_without_checksum = response_view[: len(response) - number_of_checksum_bytes]
     calculated_checksum = calculate_checksum(response_without_checksum)
 
     if received_checksum != calculated_checksum:
@@ -487,7 +768,11 @@ def _extract_payload(response, slaveaddress, mode, functioncode):
             + "is: {!r} (plain response: {!r})")
 
         text = template.format(
-            mode, received_checksum, calculated_checksum, response, plainresponse)
+            mode,
+            received_checksum,
+            calculated_checksum,
+            bytes(response),
+            bytes(plainresponse))
 
         raise ValueError(text)
 
@@ -496,7 +781,7 @@ def _extract_payload(response, slaveaddress, mode, functioncode):
     if responseaddress != slaveaddress:
         raise ValueError(
             "Wrong return slave address: {} instead of {}. The response is: {!r}".format(
-                responseaddress, slaveaddress, response))
+                responseaddress, slaveaddress, bytes(response)))
 
     _check_response_slaveerrorcode(response)
 
@@ -504,18 +789,18 @@ def _extract_payload(response, slaveaddress, mode, functioncode):
     if received_functioncode != functioncode:
         raise ValueError(
             "Wrong functioncode: {} instead of {}. The response is: {!r}".format(
-                received_functioncode, functioncode, response))
+                received_functioncode, functioncode, bytes(response)))
 
     first_databyte_number = NUMBER_OF_RESPONSE_STARTBYTES
     last_databyte_number = len(response) - NUMBER_OF_CRC_BYTES
 
-    return response[first_databyte_number:last_databyte_number]
+    return response_view[first_databyte_number:last_databyte_number]
 
 def _predict_response_size(mode, functioncode, payload_to_slave):
     """Calculate the number of bytes that should be received from the slave"""
 
     MIN_PAYLOAD_LENGTH = 4
-    BYTERANGE_FOR_GIVEN_SIZE = slice(2, 4)
+    POSITION_FOR_GIVEN_SIZE = 2
 
     NUMBER_OF_PAYLOAD_BYTES_IN_WRITE_CONFIRMATION = 4
     NUMBER_OF_PAYLOAD_BYTES_FOR_BYTECOUNTFIELD = 1
@@ -523,23 +808,18 @@ def _predict_response_size(mode, functioncode, payload_to_slave):
     NUMBER_OF_RTU_RESPONSE_STARTBYTES = 2
     NUMBER_OF_RTU_RESPONSE_ENDBYTES = 2
 
-
-    _check_mode(mode)
-    _check_functioncode(functioncode, None)
-
-    if functioncode in [5, 6, 15, 16]:
+    if functioncode in (5, 6, 15, 16):
         response_payload_size = NUMBER_OF_PAYLOAD_BYTES_IN_WRITE_CONFIRMATION
 
-    elif functioncode in [1, 2, 3, 4]:
-        given_size = _twobyte_string_to_num(payload_to_slave[BYTERANGE_FOR_GIVEN_SIZE])
-        if functioncode in [1, 2]:
+    elif functioncode in (1, 2, 3, 4):
+        given_size = _unpack_from(">H", payload_to_slave, POSITION_FOR_GIVEN_SIZE)
+        if functioncode in (1, 2):
             number_of_inputs = given_size
             response_payload_size = (
                 NUMBER_OF_PAYLOAD_BYTES_FOR_BYTECOUNTFIELD
-                + number_of_inputs // 8
-                + (1 if number_of_inputs % 8 else 0))
+                + ((number_of_inputs + 7) >> 3))
 
-        elif functioncode in [3, 4]:
+        elif functioncode in (3, 4):
             number_of_registers = given_size
             response_payload_size = (
                 NUMBER_OF_PAYLOAD_BYTES_FOR_BYTECOUNTFIELD
@@ -568,29 +848,42 @@ def _calculate_minimum_silent_period(baudrate):
         bittime * BITTIMES_PER_CHARACTERTIME * MINIMUM_SILENT_CHARACTERTIMES,
         MINIMUM_SILENT_TIME_SECONDS)
 
-def _num_to_onebyte_string(inputvalue):
-    """Convert a numerical value to a one-byte string"""
+def _calculate_character_time(baudrate):
+    """Calculate the time it takes to transmit one character"""
+
+    _check_numerical(baudrate, minvalue=1, description="baudrate")
+
+    BITTIMES_PER_CHARACTERTIME = 11
+
+    return BITTIMES_PER_CHARACTERTIME / float(baudrate)
 
-    _check_int(inputvalue, minvalue=0, maxvalue=0xFF)
-    return chr(inputvalue)
+def _calculate_response_timeout(minimum_silent_period, character_time, number_of_bytes):
+    """Calculate how long to wait for the rest of a response that has started"""
+
+    MARGIN_SECONDS = 0.005
+
+    return minimum_silent_period + number_of_bytes * character_time + MARGIN_SECONDS
+
+# The conversion helpers are only reached through _prepare_request and
+# _parse_payload, after the public methods have validated the arguments,
+# so they only check what those have not already checked
 
 def _num_to_twobyte_string(value, number_of_decimals=0, lsb_first=False, signed=False):
     """Convert a numerical value to a two-byte string, possibly scaling it"""
 
-    _check_numerical(value, description="inputvalue")
+    bytestring = bytearray(_NUMBER_OF_BYTES_PER_REGISTER)
+    _num_into_twobyte_string(bytestring, 0, value, number_of_decimals, lsb_first, signed)
+    return bytes(bytestring)
 
-    if number_of_decimals is not 0:
-	    _check_int(
-	        number_of_decimals,
-	        minvalue=0,
-	        maxvalue=_MAX_NUMBER_OF_DECIMALS,
-	        description="number of decimals")
+def _num_into_twobyte_string(
+    buffer, offset, value, number_of_decimals=0, lsb_first=False, signed=False):
+    """Pack a numerical value into two bytes of a buffer, possibly scaling it"""
 
-    _check_bool(lsb_first, description="lsb_first")
-    _check_bool(signed, description="signed parameter")
-
-    multiplier = 10 ** number_of_decimals
-    integer = int(float(value) * multiplier)
+    if number_of_decimals:
+        multiplier = 10 ** number_of_decimals
+        integer = int(float(value) * multiplier)
+    else:
+        integer = int(value)
 
     if lsb_first:
         formatcode = "<"
@@ -601,20 +894,11 @@ def _num_to_twobyte_string(value, number_of_decimals=0, lsb_first=False, signed=
     else:
         formatcode += "H"
 
-    return _pack(formatcode, integer)
+    _pack_into(formatcode, buffer, offset, integer)
 
 def _twobyte_string_to_num(bytestring, number_of_decimals=0, signed=False):
     """Convert a two-byte string to a numerical value, possibly scaling it"""
 
-    if number_of_decimals is not 0:
-	    _check_int(
-	        number_of_decimals,
-	        minvalue=0,
-	        maxvalue=_MAX_NUMBER_OF_DECIMALS,
-	        description="number of decimals")
-
-    _check_bool(signed, description="signed parameter")
-
     formatcode = ">"
     if signed:
         formatcode += "h"
@@ -623,70 +907,63 @@ def _twobyte_string_to_num(bytestring, number_of_decimals=0, signed=False):
 
     fullregister = _unpack(formatcode, bytestring)
 
-    if number_of_decimals == 0:
+    if not number_of_decimals:
         return fullregister
     divisor = 10 ** number_of_decimals
     return fullregister / float(divisor)
 
-def _long_to_bytestring(
-    value, signed=False, number_of_registers=2, byteorder=BYTEORDER_BIG):
-    """Convert a long integer to a bytestring"""
-
-    _check_int(value, description="inputvalue")
-    _check_bool(signed, description="signed parameter")
-    _check_int(
-        number_of_registers, minvalue=2, maxvalue=2, description="number of registers")
-    _check_int(
-        byteorder, minvalue=0, maxvalue=_MAX_BYTEORDER_VALUE, description="byteorder")
+def _long_into_bytestring(
+    buffer, offset, value, signed=False, number_of_registers=2, byteorder=BYTEORDER_BIG):
+    """Pack a long integer into four bytes of a buffer"""
 
-    if byteorder in [BYTEORDER_BIG, BYTEORDER_BIG_SWAP]:
-        formatcode = ">"
-    else:
-        formatcode = "<"
     if signed:
-        formatcode += "l"
+        value = _twos_complement(value, bits=32)
     else:
-        formatcode += "L"
+        _check_int(value, minvalue=0, maxvalue=0xFFFFFFFF, description="inputvalue")
 
-    outstring = _pack(formatcode, value)
-    if byteorder in [BYTEORDER_BIG_SWAP, BYTEORDER_LITTLE_SWAP]:
-        outstring = _swap(outstring)
+    # Split into registers, so that the word swap is just the packing order
+    high = value >> 16
+    low = value & 0xFFFF
 
-    assert len(outstring) == 4
-    return outstring
+    if byteorder in (BYTEORDER_BIG, BYTEORDER_BIG_SWAP):
+        formatcode = ">HH"
+    else:
+        formatcode = "<HH"
+
+    if byteorder in (BYTEORDER_BIG, BYTEORDER_LITTLE_SWAP):
+        struct.pack_into(formatcode, buffer, offset, high, low)
+    else:
+        struct.pack_into(formatcode, buffer, offset, low, high)
 
 def _bytestring_to_long(
     bytestring, signed=False, number_of_registers=2, byteorder=BYTEORDER_BIG):
     """Convert a bytestring to a long integer"""
 
-    _check_bool(signed, description="signed parameter")
-    _check_int(
-        number_of_registers, minvalue=2, maxvalue=2, description="number of registers")
-    _check_int(
-        byteorder, minvalue=0, maxvalue=_MAX_BYTEORDER_VALUE, description="byteorder")
-
-    if byteorder in [BYTEORDER_BIG, BYTEORDER_BIG_SWAP]:
-        formatcode = ">"
+    if byteorder in (BYTEORDER_BIG, BYTEORDER_BIG_SWAP):
+        formatcode = ">HH"
     else:
-        formatcode = "<"
-    if signed:
-        formatcode += "l"
-    else:
-        formatcode += "L"
+        formatcode = "<HH"
 
-    if byteorder in [BYTEORDER_BIG_SWAP, BYTEORDER_LITTLE_SWAP]:
-        bytestring = _swap(bytestring)
+    try:
+        first, second = struct.unpack(formatcode, bytestring)
+    except Exception:
+        raise ValueError(
+            "The received bytestring is probably wrong, as the bytestring-to-num "
+            + "conversion failed. Bytestring: {0!r} Struct format code is: {1}".format(
+                bytes(bytestring), formatcode))
 
-    return _unpack(formatcode, bytestring)
+    if byteorder in (BYTEORDER_BIG, BYTEORDER_LITTLE_SWAP):
+        value = (first << 16) | second
+    else:
+        value = (second << 16) | first
 
-def _float_to_bytestring(value, number_of_registers=2, byteorder=BYTEORDER_BIG):
-    """Convert a numerical value to a bytestring"""
+    if signed:
+        return _from_twos_complement(value, bits=32)
+    return value
 
-    _check_numerical(value, description="inputvalue")
-    _check_int(
-        number_of_registers, minvalue=2, maxvalue=4, description="number of registers")
-    _check_int(
-        byteorder, minvalue=0, maxvalue=_MAX_BYTEORDER_VALUE, description="byteorder")
+def _float_into_bytestring(
+    buffer, offset, value, number_of_registers=2, byteorder=BYTEORDER_BIG):
+    """Pack a numerical value as a float into a buffer"""
 
     if byteorder in [BYTEORDER_BIG, BYTEORDER_BIG_SWAP]:
         formatcode = ">"
@@ -694,29 +971,25 @@ def _float_to_bytestring(value, number_of_registers=2, byteorder=BYTEORDER_BIG):
         formatcode = "<"
     if number_of_registers == 2:
         formatcode += "f"
-        lengthtarget = 4
+        registerformat = ">HH"
     elif number_of_registers == 4:
         formatcode += "d"
-        lengthtarget = 8
+        registerformat = ">HHHH"
     else:
         raise ValueError(
             "Wrong number of registers! Given value is {0!r}".format(
                 number_of_registers))
 
-    outstring = _pack(formatcode, value)
+    _pack_into(formatcode, buffer, offset, value)
     if byteorder in [BYTEORDER_BIG_SWAP, BYTEORDER_LITTLE_SWAP]:
-        outstring = _swap(outstring)
-    assert len(outstring) == lengthtarget
-    return outstring
+        # Move the first register last, in place in the buffer
+        registers = struct.unpack_from(registerformat, buffer, offset)
+        struct.pack_into(
+            registerformat, buffer, offset, *(registers[1:] + registers[:1]))
 
 def _bytestring_to_float(bytestring, number_of_registers=2, byteorder=BYTEORDER_BIG):
     """Convert a four-byte string to a float"""
 
-    _check_int(
-        number_of_registers, minvalue=2, maxvalue=4, description="number of registers")
-    _check_int(
-        byteorder, minvalue=0, maxvalue=_MAX_BYTEORDER_VALUE, description="byteorder")
-
     number_of_bytes = _NUMBER_OF_BYTES_PER_REGISTER * number_of_registers
 
     if byteorder in [BYTEORDER_BIG, BYTEORDER_BIG_SWAP]:
@@ -725,8 +998,10 @@ def _bytestring_to_float(bytestring, number_of_registers=2, byteorder=BYTEORDER_
         formatcode = "<"
     if number_of_registers == 2:
         formatcode += "f"
+        registerformat = ">HH"
     elif number_of_registers == 4:
         formatcode += "d"
+        registerformat = ">HHHH"
     else:
         raise ValueError(
             "Wrong number of registers! Given value is {0!r}".format(
@@ -736,68 +1011,59 @@ def _bytestring_to_float(bytestring, number_of_registers=2, byteorder=BYTEORDER_
         raise ValueError(
             "Wrong length of the byte string! Given value is "
             + "{0!r}, and number_of_registers is {1!r}.".format(
-                bytestring, number_of_registers))
+                bytes(bytestring), number_of_registers))
 
     if byteorder in [BYTEORDER_BIG_SWAP, BYTEORDER_LITTLE_SWAP]:
-        bytestring = _swap(bytestring)
+        # Move the first register last, into a small buffer of its own
+        registers = struct.unpack(registerformat, bytestring)
+        swapped = bytearray(number_of_bytes)
+        struct.pack_into(registerformat, swapped, 0, *(registers[1:] + registers[:1]))
+        bytestring = swapped
     return _unpack(formatcode, bytestring)
 
-def _valuelist_to_bytestring(valuelist, number_of_registers):
-    """Convert a list of numerical values to a bytestring"""
+def _valuelist_into_bytestring(buffer, offset, valuelist, number_of_registers):
+    """Pack a list of numerical values into a buffer"""
 
     MINVALUE = 0
     MAXVALUE = 0xFFFF
 
-    _check_int(number_of_registers, minvalue=1, description="number of registers")
-
     if not isinstance(valuelist, list):
         raise TypeError(
             "The valuelist parameter must be a list. Given {0!r}.".format(valuelist))
 
-    for value in valuelist:
-        _check_int(
-            value,
-            minvalue=MINVALUE,
-            maxvalue=MAXVALUE,
-            description="elements in the input value list")
-
     _check_int(
         len(valuelist),
         minvalue=number_of_registers,
         maxvalue=number_of_registers,
         description="length of the list")
 
-    number_of_bytes = _NUMBER_OF_BYTES_PER_REGISTER * number_of_registers
-
-    bytestring = b""
-    for value in valuelist:
-        bytestring += _num_to_twobyte_string(value, signed=False)
+    # Range check the whole list at once, min and max fail on elements that
+    # can not be compared and struct rejects the other non-integers
+    try:
+        in_range = min(valuelist) >= MINVALUE and max(valuelist) <= MAXVALUE
+        if in_range:
+            struct.pack_into(
+                ">{}H".format(number_of_registers), buffer, offset, *valuelist)
+    except Exception:
+        raise TypeError(
+            "The elements in the input value list must be integers. "
+            + "Given: {0!r}".format(valuelist))
 
-    assert len(bytestring) == number_of_bytes
-    return bytestring
+    if not in_range:
+        raise ValueError(
+            "The elements in the input value list must be in the range "
+            + "{0} to {1}. Given: {2!r}".format(MINVALUE, MAXVALUE, valuelist))
 
 def _bytestring_to_valuelist(bytestring, number_of_registers):
     """Convert a bytestring to a list of numerical values"""
 
-    _check_int(number_of_registers, minvalue=1, description="number of registers")
-
-    number_of_bytes = _NUMBER_OF_BYTES_PER_REGISTER * number_of_registers
-
-    values = []
-    for i in range(number_of_registers):
-        offset = _NUMBER_OF_BYTES_PER_REGISTER * i
-        substring = bytestring[offset : (offset + _NUMBER_OF_BYTES_PER_REGISTER)]
-        values.append(_twobyte_string_to_num(substring))
-
-    return values
-
-def _pack(formatstring, value):
-    """Pack a value into a bytestring"""
+    return list(struct.unpack(">{}H".format(number_of_registers), bytestring))
 
-    _check_string(formatstring, description="formatstring", minlength=1)
+def _pack_into(formatstring, buffer, offset, value):
+    """Pack a value into a buffer, starting at offset"""
 
     try:
-        result = struct.pack(formatstring, value)
+        struct.pack_into(formatstring, buffer, offset, value)
     except Exception:
         errortext = (
             "The value to send is probably out of range, as the num-to-bytestring ")
@@ -805,8 +1071,6 @@ def _pack(formatstring, value):
         errortext += "conversion failed. Value: {0!r} Struct format code is: {1}"
         raise ValueError(errortext.format(value, formatstring))
 
-    return result
-
 def _unpack(formatstring, packed):
     """Unpack a bytestring into a value"""
 
@@ -817,31 +1081,30 @@ def _unpack(formatstring, packed):
             "The received bytestring is probably wrong, as the bytestring-to-num ")
 
         errortext += "conversion failed. Bytestring: {0!r} Struct format code is: {1}"
-        raise ValueError(errortext.format(packed, formatstring))
+        raise ValueError(errortext.format(bytes(packed), formatstring))
 
     return value
 
-def _swap(bytestring):
-    """Swap 2xMSB bytes with 2xLSB"""
+def _unpack_from(formatstring, buffer, offset):
+    """Unpack a value from a buffer, starting at offset"""
 
-    length = len(bytestring)
-    if length % 2:
-        raise ValueError(
-            "The length of the bytestring should be even. Given {!r}.".format(
-                bytestring))
+    try:
+        value = struct.unpack_from(formatstring, buffer, offset)[0]
+    except Exception:
+        errortext = (
+            "The received bytestring is probably wrong, as the bytestring-to-num ")
 
-    return bytestring[2:] + bytestring[:2]
+        errortext += "conversion failed. Bytestring: {0!r} Struct format code is: {1}"
+        raise ValueError(errortext.format(bytes(buffer), formatstring))
+
+    return value
 
 def _hexencode(bytestring, insert_spaces=False):
     """Convert a byte string to a hex encoded string"""
 
-    separator = "" if not insert_spaces else " "
-
-    byte_representions = []
-    for char in bytestring:
-        byte_representions.append(hex(char))
-
-    return separator.join(byte_representions).strip()
+    if insert_spaces:
+        return binascii.hexlify(bytestring, b" ").decode()
+    return binascii.hexlify(bytestring).decode()
 
 def _hexdecode(hexstring):
     """Convert a hex encoded string to a byte string"""
@@ -852,11 +1115,10 @@ def _hexdecode(hexstring):
         raise ValueError(
             "The input hexstring must be of even length. Given: {!r}".format(hexstring))
 
-    converted_bytes = bytes(hexstring, "latin1")
-
+    # binascii.Error is a ValueError, and MicroPython raises ValueError directly
     try:
-        return str(binascii.unhexlify(converted_bytes), encoding="latin1")
-    except binascii.Error as err:
+        return binascii.unhexlify(hexstring)
+    except ValueError as err:
         new_error_message = "Hexdecode reported an error: {!s}. Input hexstring: {}".format(
             err.args[0], hexstring)
         raise TypeError(new_error_message)
@@ -869,10 +1131,7 @@ def _hexlify(bytestring):
 def _calculate_number_of_bytes_for_bits(number_of_bits):
     """Calculate number of full bytes required to house a number of bits"""
 
-    result = number_of_bits // _BITS_PER_BYTE
-    if number_of_bits % _BITS_PER_BYTE:
-        result += 1
-    return result
+    return (number_of_bits + 7) >> 3
 
 def _bit_to_bytestring(value):
     """Create the bit pattern that is used for writing single bits"""
@@ -880,9 +1139,9 @@ def _bit_to_bytestring(value):
     _check_int(value, minvalue=0, maxvalue=1, description="inputvalue")
 
     if value == 0:
-        return "\x00\x00"
+        return b"\x00\x00"
     else:
-        return "\xff\x00"
+        return b"\xff\x00"
 
 def _bits_to_bytestring(valuelist):
     """Build a bytestring from a list of bits"""
@@ -891,58 +1150,56 @@ def _bits_to_bytestring(valuelist):
         raise TypeError(
             "The input should be a list. " + "Given: {!r}".format(valuelist))
 
-    for value in valuelist:
-        if value not in [0, 1, False, True]:
+    if np is not None:
+        bits = np.asarray(valuelist)
+        # Anything but a list of 0/1 integers or bools is left to the loop below
+        if bits.dtype.kind in "biu" and not ((bits != 0) & (bits != 1)).any():
+            return np.packbits(bits.astype(np.uint8), bitorder="little").tobytes()
+
+    # Set the bits directly in a preallocated buffer rather than building
+    # one big integer, as not all builds support arbitrary precision ints
+    outputstring = bytearray(_calculate_number_of_bytes_for_bits(len(valuelist)))
+    for bitposition, value in enumerate(valuelist):
+        if value not in (0, 1):
             raise ValueError(
                 "Wrong value in list of bits. " + "Given: {!r}".format(value))
 
-    list_position = 0
-    outputstring = ""
-    while list_position < len(valuelist):
-        sublist = valuelist[list_position : (list_position + _BITS_PER_BYTE)]
-
-        bytevalue = 0
-        for bitposition, value in enumerate(sublist):
-            bytevalue |= value << bitposition
-        outputstring += chr(bytevalue)
+        if value:
+            outputstring[bitposition >> 3] |= 1 << (bitposition & 7)
 
-        list_position += _BITS_PER_BYTE
-    return outputstring
+    return bytes(outputstring)
 
 def _bytestring_to_bits(bytestring, number_of_bits):
     """Parse bits from a bytestring"""
 
-    expected_length = _calculate_number_of_bytes_for_bits(number_of_bits)
+    expected_length = (number_of_bits + 7) >> 3
     if len(bytestring) != expected_length:
         raise ValueError(
             "Wrong length of bytestring. Expected is "
             + "{} bytes (for {} bits), actual is {} bytes.".format(
                 expected_length, number_of_bits, len(bytestring)))
 
-    total_list = []
-    for byte in bytestring:
-        for bitposition in range(_BITS_PER_BYTE):
-            bitvalue = (byte & (1 << bitposition)) > 0
-            total_list.append(int(bitvalue))
+    if np is not None:
+        bits = np.unpackbits(np.frombuffer(bytestring, dtype=np.uint8), bitorder="little")
+        return bits[:number_of_bits].tolist()
 
-    return total_list[:number_of_bits]
+    return [(bytestring[i >> 3] >> (i & 7)) & 1 for i in range(number_of_bits)]
 
 def _twos_complement(x, bits=16):
     """Calculate the two's complement of an integer"""
 
     _check_int(bits, minvalue=0, description="number of bits")
     _check_int(x, description="input")
-    upperlimit = 2 ** (bits - 1) - 1
-    lowerlimit = -2 ** (bits - 1)
+    upperlimit = (1 << (bits - 1)) - 1
+    lowerlimit = -(1 << (bits - 1))
     if x > upperlimit or x < lowerlimit:
         raise ValueError(
             "The input value is out of range. Given value is "
             + "{0}, but allowed range is {1} to {2} when using {3} bits.".format(
                 x, lowerlimit, upperlimit, bits))
 
-    if x >= 0:
-        return x
-    return x + 2 ** bits
+    # Negative integers behave as infinite two's complement under &
+    return x & ((1 << bits) - 1)
 
 def _from_twos_complement(x, bits=16):
     """Calculate the inverse(?) of a two's complement of an integer"""
@@ -950,7 +1207,7 @@ def _from_twos_complement(x, bits=16):
     _check_int(bits, minvalue=0, description="number of bits")
     _check_int(x, description="input")
 
-    upperlimit = 2 ** (bits) - 1
+    upperlimit = (1 << bits) - 1
     lowerlimit = 0
 
     if x > upperlimit or x < lowerlimit:
@@ -959,62 +1216,146 @@ def _from_twos_complement(x, bits=16):
             + "{0}, but allowed range is {1} to {2} when using {3} bits.".format(
                 x, lowerlimit, upperlimit, bits))
 
-    limit = 2 ** (bits - 1) - 1
-    if x <= limit:
-        return x
-    return x - 2 ** bits
+    signbit = 1 << (bits - 1)
+    return ((x + signbit) & upperlimit) - signbit
 
-def _set_bit_on(x, bit_num):
-    """Set bit 'bit_num' to True"""
+def _check_bit(x, bit_num):
+    """Check if bit 'bit_num' (0 to 15, see _BIT_MASKS) is set in the input integer"""
 
-    _check_int(x, minvalue=0, description="input value")
-    _check_int(bit_num, minvalue=0, description="bitnumber")
+    return (x & _BIT_MASKS[bit_num]) != 0
 
-    return x | (1 << bit_num)
+def _gen_crc16_table():
+    """Generate the lookup table for the Modbus CRC-16, one entry per byte value"""
 
-def _check_bit(x, bit_num):
-    """Check if bit 'bit_num' is set the input integer"""
-
-    _check_int(x, minvalue=0, description="input value")
-    _check_int(bit_num, minvalue=0, description="bitnumber")
-
-    return (x & (1 << bit_num)) > 0
-
-_CRC16TABLE = (
-	0, 49345, 49537, 320, 49921, 960, 640, 49729, 50689, 1728, 1920, 51009,
-	1280, 50625, 50305, 1088, 52225, 3264, 3456, 52545, 3840, 53185, 52865,
-	3648, 2560, 51905, 52097, 2880, 51457, 2496, 2176, 51265, 55297, 6336,
-	6528, 55617, 6912, 56257, 55937, 6720, 7680, 57025, 57217, 8000, 56577,
-	7616, 7296, 56385, 5120, 54465, 54657, 5440, 55041, 6080, 5760, 54849,
-	53761, 4800, 4992, 54081, 4352, 53697, 53377, 4160, 61441, 12480, 12672,
-	61761, 13056, 62401, 62081, 12864, 13824, 63169, 63361, 14144, 62721,
-	13760, 13440, 62529, 15360, 64705, 64897, 15680, 65281, 16320, 16000,
-	65089, 64001, 15040, 15232, 64321, 14592, 63937, 63617, 14400, 10240,
-	59585, 59777, 10560, 60161, 11200, 10880, 59969, 60929, 11968, 12160,
-	61249, 11520, 60865, 60545, 11328, 58369, 9408, 9600, 58689, 9984, 59329,
-	59009, 9792, 8704, 58049, 58241, 9024, 57601, 8640, 8320, 57409, 40961,
-	24768, 24960, 41281, 25344, 41921, 41601, 25152, 26112, 42689, 42881,
-	26432, 42241, 26048, 25728, 42049, 27648, 44225, 44417, 27968, 44801,
-	28608, 28288, 44609, 43521, 27328, 27520, 43841, 26880, 43457, 43137,
-	26688, 30720, 47297, 47489, 31040, 47873, 31680, 31360, 47681, 48641,
-	32448, 32640, 48961, 32000, 48577, 48257, 31808, 46081, 29888, 30080,
-	46401, 30464, 47041, 46721, 30272, 29184, 45761, 45953, 29504, 45313,
-	29120, 28800, 45121, 20480, 37057, 37249, 20800, 37633, 21440, 21120,
-	37441, 38401, 22208, 22400, 38721, 21760, 38337, 38017, 21568, 39937,
-	23744, 23936, 40257, 24320, 40897, 40577, 24128, 23040, 39617, 39809,
-	23360, 39169, 22976, 22656, 38977, 34817, 18624, 18816, 35137, 19200,
-	35777, 35457, 19008, 19968, 36545, 36737, 20288, 36097, 19904, 19584,
-	35905, 17408, 33985, 34177, 17728, 34561, 18368, 18048, 34369, 33281,
-	17088, 17280, 33601, 16640, 33217, 32897, 16448)
+    POLYNOMIAL = 0xA001
 
-def _calculate_crc_string(inputstring):
-    """Calculate CRC-16 for Modbus"""
+    table = array.array("H", bytes(2 * 256))
+    for value in range(256):
+        register = value
+        for _ in range(8):
+            if register & 1:
+                register = (register >> 1) ^ POLYNOMIAL
+            else:
+                register >>= 1
+        table[value] = register
+
+    return table
+
+_CRC16TABLE = _gen_crc16_table()
+
+def _crc16(inputstring):
+    """Calculate the CRC-16 register value for Modbus in plain Python"""
 
+    table = _CRC16TABLE
     register = 0xFFFF
     for char in inputstring:
-        register = (register >> 8) ^ _CRC16TABLE[(register ^ char) & 0xFF]
+        register = (register >> 8) ^ table[(register ^ char) & 0xFF]
+
+    return register
+
+# The viper and native emitters are compile time features, and a build
+# without them rejects the decorators. Compile them here so that the
+# module still loads, falling back from viper to native to plain Python
+_CRC16_EMITTER_SOURCES = (
+    """
+import micropython
+
+@micropython.viper
+def _crc16(inputstring) -> int:
+    data = ptr8(inputstring)
+    table = ptr16(_CRC16TABLE)
+    length = int(len(inputstring))
+    register = 0xFFFF
+    for i in range(length):
+        register = (register >> 8) ^ table[(register ^ data[i]) & 0xFF]
+    return register
+""",
+    """
+import micropython
+
+@micropython.native
+def _crc16(inputstring):
+    table = _CRC16TABLE
+    register = 0xFFFF
+    for char in inputstring:
+        register = (register >> 8) ^ table[(register ^ char) & 0xFF]
+    return register
+""")
+
+def _make_crc16_slice_tables():
+    """Build the slice-by-8 tables, table k is for a byte followed by k zero bytes"""
+
+    tables = np.zeros((8, 256), dtype=np.uint16)
+    tables[0] = _CRC16TABLE
+    for k in range(1, 8):
+        for i in range(256):
+            previous = int(tables[k - 1][i])
+            tables[k][i] = (previous >> 8) ^ _CRC16TABLE[previous & 0xFF]
+    return tables
+
+def _crc16_slice_by_8(data, tables):
+    """Calculate the CRC-16 register value for a uint8 array, eight bytes at a time"""
+
+    # Table entries are widened to int64 so that numba types the register as
+    # a signed integer, instead of unifying signed and unsigned to float
+    register = 0xFFFF
+    length = data.shape[0]
+    end_of_blocks = length - length % 8
+
+    for i in range(0, end_of_blocks, 8):
+        register = (
+            np.int64(tables[7][data[i] ^ (register & 0xFF)])
+            ^ np.int64(tables[6][data[i + 1] ^ (register >> 8)])
+            ^ np.int64(tables[5][data[i + 2]])
+            ^ np.int64(tables[4][data[i + 3]])
+            ^ np.int64(tables[3][data[i + 4]])
+            ^ np.int64(tables[2][data[i + 5]])
+            ^ np.int64(tables[1][data[i + 6]])
+            ^ np.int64(tables[0][data[i + 7]]))
+
+    for i in range(end_of_blocks, length):
+        register = (register >> 8) ^ np.int64(tables[0][(register ^ data[i]) & 0xFF])
+
+    return register
+
+def _crc16_numba(inputstring):
+    """Calculate the CRC-16 register value with the compiled slice-by-8 loop"""
+
+    # Below this length the call into the compiled code costs more than it saves
+    MIN_LENGTH_FOR_COMPILED_LOOP = 12
+
+    if len(inputstring) < MIN_LENGTH_FOR_COMPILED_LOOP:
+        return _crc16_bytewise(inputstring)
+
+    data = np.frombuffer(inputstring, dtype=np.uint8)
+    return int(_crc16_slice_by_8_compiled(data, _CRC16_SLICE_TABLES))
+
+# A board may provide the CRC natively, either as a compiled module or by
+# wrapping a hardware CRC unit, as _crc16_modbus.crc(data) -> register
+try:
+    from _crc16_modbus import crc as _crc16
+except ImportError:
+    if njit is not None:
+        _CRC16_SLICE_TABLES = _make_crc16_slice_tables()
+        _crc16_slice_by_8_compiled = njit(cache=True)(_crc16_slice_by_8)
+        _crc16_bytewise = _crc16
+        _crc16 = _crc16_numba
+    else:
+        for _source in _CRC16_EMITTER_SOURCES:
+            try:
+                exec(_source)
+                break
+            except Exception:
+                pass
+
+def _calculate_crc_string(inputstring):
+    """Calculate CRC-16 for Modbus"""
+
+    # The kernels iterate over byte values, so convert a str once up front
+    if isinstance(inputstring, str):
+        inputstring = inputstring.encode("latin-1")
 
-    return _num_to_twobyte_string(register, lsb_first=True)
+    return struct.pack("<H", _crc16(inputstring))
 
 def _check_mode(mode):
     """Check that the Modbus mode is RTU"""
@@ -1039,18 +1380,12 @@ def _check_functioncode(functioncode, list_of_allowed_values=None):
     if list_of_allowed_values is None:
         return
 
-    if not isinstance(list_of_allowed_values, list):
+    # The allowed values are fixed by the callers, so they are not checked here
+    if not isinstance(list_of_allowed_values, (list, tuple)):
         raise TypeError(
             "The list_of_allowed_values should be a list. Given: {0!r}".format(
                 list_of_allowed_values))
 
-    for value in list_of_allowed_values:
-        _check_int(
-            value,
-            FUNCTIONCODE_MIN,
-            FUNCTIONCODE_MAX,
-            description="functioncode inside list_of_allowed_values")
-
     if functioncode not in list_of_allowed_values:
         raise ValueError(
             "Wrong function code: {0}, allowed values are {1!r}".format(
@@ -1088,59 +1423,62 @@ def _check_response_payload(
     signed,
     byteorder,
     payloadformat):
+    """Check the payload of the response, as far as the function code allows"""
 
-    if functioncode in [1, 2, 3, 4]:
+    # The function codes are tested in order of how often they are used
+    if functioncode in (3, 4):
         _check_response_bytecount(payload)
+        _check_response_registerdata_length(
+            payload, number_of_registers * _NUMBER_OF_BYTES_PER_REGISTER)
 
-    if functioncode in [5, 6, 15, 16]:
+    elif functioncode == 16:
         _check_response_registeraddress(payload, registeraddress)
+        _check_response_number_of_registers(payload, number_of_registers)
 
-    if functioncode == 5:
+    elif functioncode in (1, 2):
+        _check_response_bytecount(payload)
+        _check_response_registerdata_length(payload, (number_of_bits + 7) >> 3)
+
+    elif functioncode == 15:
+        _check_response_registeraddress(payload, registeraddress)
+        _check_response_number_of_registers(payload, number_of_bits)
+
+    elif functioncode == 5:
+        _check_response_registeraddress(payload, registeraddress)
         _check_response_writedata(payload, _bit_to_bytestring(value))
+
     elif functioncode == 6:
+        _check_response_registeraddress(payload, registeraddress)
         _check_response_writedata(
             payload, _num_to_twobyte_string(value, number_of_decimals, signed=signed))
 
-    elif functioncode == 15:
-        _check_response_number_of_registers(payload, number_of_bits)
-
-    elif functioncode == 16:
-        _check_response_number_of_registers(payload, number_of_registers)
+def _check_response_registerdata_length(payload, expected_number_of_bytes):
+    """Check that the response holds the expected number of data bytes"""
 
-    if functioncode in [1, 2]:
-        registerdata = payload[_NUMBER_OF_BYTES_BEFORE_REGISTERDATA:]
-        expected_number_of_bytes = _calculate_number_of_bytes_for_bits(number_of_bits)
-        if len(registerdata) != expected_number_of_bytes:
-            raise ValueError(
-                "The data length is wrong for payloadformat BIT/BITS."
-                + " Expected: {} Actual: {}.".format(
-                    expected_number_of_bytes, len(registerdata)))
-
-    # Response for read registers
-    if functioncode in [3, 4]:
-        registerdata = payload[_NUMBER_OF_BYTES_BEFORE_REGISTERDATA:]
-        number_of_register_bytes = number_of_registers * _NUMBER_OF_BYTES_PER_REGISTER
-        if len(registerdata) != number_of_register_bytes:
-            raise ValueError(
-                "The register data length is wrong. "
-                + "Registerdata: {!r} bytes. Expected: {!r}.".format(
-                    len(registerdata), number_of_register_bytes))
+    number_of_data_bytes = len(payload) - _NUMBER_OF_BYTES_BEFORE_REGISTERDATA
+    if number_of_data_bytes != expected_number_of_bytes:
+        raise ValueError(
+            "The register data length is wrong. "
+            + "Registerdata: {!r} bytes. Expected: {!r}.".format(
+                number_of_data_bytes, expected_number_of_bytes))
+
+# Slave error codes that do not indicate a failure (5 is acknowledge)
+_SLAVE_NON_ERRORS = (5,)
+
+_SLAVE_ERRORS = {
+    1: "Slave reported illegal function",
+    2: "Slave reported illegal data address",
+    3: "Slave reported illegal data value",
+    4: "Slave reported device failure",
+    6: "Slave reported device busy",
+    7: "Slave reported negative acknowledge",
+    8: "Slave reported memory parity error",
+    10: "Slave reported gateway path unavailable",
+    11: "Slave reported gateway target device failed to respond"}
 
 def _check_response_slaveerrorcode(response):
     """Check if the slave indicates an error"""
 
-    NON_ERRORS = [5]
-    SLAVE_ERRORS = {
-        1: "Slave reported illegal function",
-        2: "Slave reported illegal data address",
-        3: "Slave reported illegal data value",
-        4: "Slave reported device failure",
-        6: "Slave reported device busy",
-        7: "Slave reported negative acknowledge",
-        8: "Slave reported memory parity error",
-        10: "Slave reported gateway path unavailable",
-        11: "Slave reported gateway target device failed to respond"}
-
     if len(response) < _BYTEPOSITION_FOR_SLAVE_ERROR_CODE + 1:
         return
 
@@ -1149,15 +1487,11 @@ def _check_response_slaveerrorcode(response):
     if _check_bit(received_functioncode, _BITNUMBER_FUNCTIONCODE_ERRORINDICATION):
         slave_error_code = response[_BYTEPOSITION_FOR_SLAVE_ERROR_CODE]
 
-        if slave_error_code in NON_ERRORS:
+        if slave_error_code in _SLAVE_NON_ERRORS:
             return
 
-        error = SLAVE_ERRORS.get(
-            slave_error_code,
-            ValueError(
-                "Slave reported error code " + str(slave_error_code)))
-
-        raise error
+        raise ValueError(_SLAVE_ERRORS.get(
+            slave_error_code, "Slave reported error code " + str(slave_error_code)))
 
 def _check_response_bytecount(payload):
     """Check that the number of bytes as given in the response is correct"""
@@ -1178,59 +1512,52 @@ def _check_response_bytecount(payload):
             given_number_of_databytes,
             counted_number_of_databytes,
             len(payload),
-            payload)
+            bytes(payload))
 
         raise ValueError(errortext)
 
 def _check_response_registeraddress(payload, registeraddress):
     """Check that the start adress as given in the response is correct"""
 
-    _check_registeraddress(registeraddress)
+    POSITION_FOR_STARTADDRESS = 0
 
-    BYTERANGE_FOR_STARTADDRESS = slice(0, 2)
-
-    bytes_for_startaddress = payload[BYTERANGE_FOR_STARTADDRESS]
-    received_startaddress = _twobyte_string_to_num(bytes_for_startaddress)
+    received_startaddress = _unpack_from(">H", payload, POSITION_FOR_STARTADDRESS)
 
     if received_startaddress != registeraddress:
         raise ValueError(
             "Wrong given write start adress: "
             + "{0}, but commanded is {1}. The data payload is: {2!r}".format(
-                received_startaddress, registeraddress, payload))
+                received_startaddress, registeraddress, bytes(payload)))
 
 def _check_response_number_of_registers(payload, number_of_registers):
     """Check that the number of written registers as given in the response is correct"""
 
-    _check_int(
-        number_of_registers,
-        minvalue=1,
-        maxvalue=max(
-            _MAX_NUMBER_OF_REGISTERS_TO_READ, _MAX_NUMBER_OF_REGISTERS_TO_WRITE),
-        description="number of registers")
-
-    BYTERANGE_FOR_NUMBER_OF_REGISTERS = slice(2, 4)
+    POSITION_FOR_NUMBER_OF_REGISTERS = 2
 
-    bytes_for_mumber_of_registers = payload[BYTERANGE_FOR_NUMBER_OF_REGISTERS]
-    received_number_of_written_registers = _twobyte_string_to_num(
-        bytes_for_mumber_of_registers)
+    received_number_of_written_registers = _unpack_from(
+        ">H", payload, POSITION_FOR_NUMBER_OF_REGISTERS)
 
     if received_number_of_written_registers != number_of_registers:
         raise ValueError(
             "Wrong number of registers to write in the response: "
             + "{0}, but commanded is {1}. The data payload is: {2!r}".format(
-                received_number_of_written_registers, number_of_registers, payload))
+                received_number_of_written_registers, number_of_registers, bytes(payload)))
 
 def _check_response_writedata(payload, writedata):
     """Check that the write data as given in the response is correct"""
 
-    BYTERANGE_FOR_WRITEDATA = slice(2, 4)
-    received_writedata = payload[BYTERANGE_FOR_WRITEDATA]
+    POSITION_FOR_WRITEDATA = 2
 
-    if received_writedata != writedata:
+    # Compare as integers, so that nothing is sliced out on the good path
+    received_writedata = _unpack_from(">H", payload, POSITION_FOR_WRITEDATA)
+
+    if received_writedata != _unpack_from(">H", writedata, 0):
         raise ValueError(
             "Wrong write data in the response: "
             + "{0!r}, but commanded is {1!r}. The data payload is: {2!r}".format(
-                received_writedata, writedata, payload))
+                bytes(payload[POSITION_FOR_WRITEDATA:POSITION_FOR_WRITEDATA + 2]),
+                writedata,
+                bytes(payload)))
 
 def _check_string(
     inputstring,
@@ -1243,71 +1570,77 @@ def _check_string(
 
     if not isinstance(description, str):
         raise TypeError(
-            "The description should be a string. Given: {0!r}".format(description))
+            "The description should be a string. Given: %r" % (description,))
 
     if not isinstance(inputstring, str):
         raise TypeError(
-            "The {0} should be a string. Given: {1!r}".format(description, inputstring))
+            "The %s should be a string. Given: %r" % (description, inputstring))
 
-    if not isinstance(maxlength, (int, type(None))):
+    if not isinstance(maxlength, _INT_OR_NONE_TYPES):
         raise TypeError(
-            "The maxlength must be an integer or None. Given: {0!r}".format(maxlength))
+            "The maxlength must be an integer or None. Given: %r" % (maxlength,))
     try:
         issubclass(exception_type, Exception)
     except TypeError:
         raise TypeError(
             "The exception_type must be an exception class. "
-            + "It not even a class. Given: {0!r}".format(type(exception_type)))
+            + "It not even a class. Given: %r" % (type(exception_type),))
     if not issubclass(exception_type, Exception):
         raise TypeError(
-            "The exception_type must be an exception class. Given: {0!r}".format(
-                type(exception_type)))
+            "The exception_type must be an exception class. Given: %r" % (
+                type(exception_type),))
 
     _check_int(minlength, minvalue=0, maxvalue=None, description="minlength")
 
     if len(inputstring) < minlength:
         raise exception_type(
-            "The {0} is too short: {1}, but minimum value is {2}. Given: {3!r}".format(
+            "The %s is too short: %s, but minimum value is %s. Given: %r" % (
                 description, len(inputstring), minlength, inputstring))
 
     if maxlength is not None:
         if maxlength < 0:
             raise ValueError(
-                "The maxlength must be positive. Given: {0}".format(maxlength))
+                "The maxlength must be positive. Given: %s" % (maxlength,))
 
         if maxlength < minlength:
             raise ValueError(
-                "The maxlength must not be smaller than minlength. Given: {0} and {1}".format(
+                "The maxlength must not be smaller than minlength. Given: %s and %s" % (
                     maxlength, minlength))
 
         if len(inputstring) > maxlength:
             raise exception_type(
-                "The {0} is too long: {1}, but maximum value is {2}. Given: {3!r}".format(
+                "The %s is too long: %s, but maximum value is %s. Given: %r" % (
                     description, len(inputstring), maxlength, inputstring))
 
-    if force_ascii and sys.version > "3":
+    if force_ascii and _PY3:
         try:
             inputstring.encode("ascii")
         except UnicodeEncodeError:
             raise ValueError(
-                "The {0} must be ASCII. Given: {1!r}".format(description, inputstring))
+                "The %s must be ASCII. Given: %r" % (description, inputstring))
 
 def _check_int(inputvalue, minvalue=None, maxvalue=None, description="inputvalue"):
     """Check that the given integer is valid"""
 
+    # Fast path for the common valid case, the checks below build the errors
+    if (type(inputvalue) is int
+            and (minvalue is None or inputvalue >= minvalue)
+            and (maxvalue is None or inputvalue <= maxvalue)):
+        return
+
     if not isinstance(description, str):
         raise TypeError(
             "The description should be a string. Given: {0!r}".format(description))
 
-    if not isinstance(inputvalue, (int, long)):
+    if not isinstance(inputvalue, _INT_TYPES):
         raise TypeError(
             "The {0} must be an integer. Given: {1!r}".format(description, inputvalue))
 
-    if not isinstance(minvalue, (int, long, type(None))):
+    if not isinstance(minvalue, _INT_OR_NONE_TYPES):
         raise TypeError(
             "The minvalue must be an integer or None. Given: {0!r}".format(minvalue))
 
-    if not isinstance(maxvalue, (int, long, type(None))):
+    if not isinstance(maxvalue, _INT_OR_NONE_TYPES):
         raise TypeError(
             "The maxvalue must be an integer or None. Given: {0!r}".format(maxvalue))
 
@@ -1317,43 +1650,53 @@ def _check_numerical(
     inputvalue, minvalue=None, maxvalue=None, description="inputvalue"):
     """Check that the given numerical value is valid"""
 
+    # Fast path for the common case of both limits given and the value within them
+    if (minvalue is not None
+            and maxvalue is not None
+            and type(inputvalue) in (int, float)
+            and minvalue <= inputvalue <= maxvalue):
+        return
+
     if not isinstance(description, str):
         raise TypeError(
-            "The description should be a string. Given: {0!r}".format(description))
+            "The description should be a string. Given: %r" % (description,))
 
-    if not isinstance(inputvalue, (int, long, float)):
+    if not isinstance(inputvalue, _NUM_TYPES):
         raise TypeError(
-            "The {0} must be numerical. Given: {1!r}".format(description, inputvalue))
+            "The %s must be numerical. Given: %r" % (description, inputvalue))
 
-    if not isinstance(minvalue, (int, float, long, type(None))):
+    if not isinstance(minvalue, _NUM_OR_NONE_TYPES):
         raise TypeError(
-            "The minvalue must be numeric or None. Given: {0!r}".format(minvalue))
+            "The minvalue must be numeric or None. Given: %r" % (minvalue,))
 
-    if not isinstance(maxvalue, (int, float, long, type(None))):
+    if not isinstance(maxvalue, _NUM_OR_NONE_TYPES):
         raise TypeError(
-            "The maxvalue must be numeric or None. Given: {0!r}".format(maxvalue))
+            "The maxvalue must be numeric or None. Given: %r" % (maxvalue,))
 
     if (minvalue is not None) and (maxvalue is not None):
         if maxvalue < minvalue:
             raise ValueError(
                 "The maxvalue must not be smaller than minvalue. "
-                + "Given: {0} and {1}, respectively.".format(maxvalue, minvalue))
+                + "Given: %s and %s, respectively." % (maxvalue, minvalue))
 
     if minvalue is not None:
         if inputvalue < minvalue:
             raise ValueError(
-                "The {0} is too small: {1}, but minimum value is {2}.".format(
+                "The %s is too small: %s, but minimum value is %s." % (
                     description, inputvalue, minvalue))
 
     if maxvalue is not None:
         if inputvalue > maxvalue:
             raise ValueError(
-                "The {0} is too large: {1}, but maximum value is {2}.".format(
+                "The %s is too large: %s, but maximum value is %s." % (
                     description, inputvalue, maxvalue))
 
 def _check_bool(inputvalue, description="inputvalue"):
     """Check that the given inputvalue is a boolean"""
 
+    if inputvalue is True or inputvalue is False:
+        return
+
     _check_string(description, minlength=1, description="description string")
     if not isinstance(inputvalue, bool):
         raise TypeError(